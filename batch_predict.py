@@ -0,0 +1,167 @@
+'''Headless batch prediction over a JSONL or CSV file of talks.
+
+Every input record needs a transcript and a tags field (a string with one
+tag per line, a JSON list, or the Kaggle "['tag', ...]" notation). Records
+are read, cleaned, vectorized and scored one chunk at a time and the results
+are appended to the output file, so memory stays bounded by --chunk-size.
+
+    python batch_predict.py talks.jsonl predictions.jsonl --n-process 4
+'''
+import argparse
+import ast
+import collections
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+
+from ted_pipeline import clean_texts, predict_cleaned
+
+
+def _format(path, requested):
+    if requested:
+        return requested
+    return 'csv' if os.path.splitext(path)[1].lower() == '.csv' else 'jsonl'
+
+
+def read_records(path, fmt=None):
+    '''stream dict records from a JSONL or CSV file ('-' reads stdin)'''
+    fmt = _format(path, fmt)
+    handle = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if fmt == 'csv':
+            csv.field_size_limit(sys.maxsize)
+            yield from csv.DictReader(handle)
+        else:
+            for line in handle:
+                if line.strip():
+                    yield json.loads(line)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+
+
+def tags_text(value):
+    '''one tag per line, whatever notation the input uses'''
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.lstrip().startswith('['):
+        try:
+            value = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            return value
+    if isinstance(value, (list, tuple)):
+        return '\n'.join(str(tag).strip() for tag in value)
+    return str(value)
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def clean_stream(records, transcript_field='transcript', n_process=1, batch_size=32, backend=None):
+    '''(record, cleaned transcript) pairs, with a single nlp.pipe over the whole input'''
+    pending = collections.deque()
+
+    def transcripts():
+        for record in records:
+            pending.append(record)
+            yield record.get(transcript_field) or ''
+
+    for cleaned in clean_texts(transcripts(), n_process=n_process, batch_size=batch_size,
+                               backend=backend):
+        yield pending.popleft(), cleaned
+
+
+def score_chunk(records, cleaned, transcript_field='transcript', tags_field='tags'):
+    '''one result dict per record; each model scores the chunk as one sparse matrix'''
+    summaries = predict_cleaned(cleaned, [tags_text(record.get(tags_field)) for record in records])
+    results = []
+    for record, summary in zip(records, summaries):
+        result = {key: value for key, value in record.items()
+                  if key not in (transcript_field, tags_field)}
+        result.update(summary)
+        results.append(result)
+    return results
+
+
+class ResultWriter:
+    '''appends result dicts as JSONL or CSV, flushing after every chunk'''
+
+    def __init__(self, path, fmt=None):
+        self.fmt = _format(path, fmt)
+        self.handle = sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+        self.csv_writer = None
+
+    def write(self, results):
+        for result in results:
+            if self.fmt == 'csv':
+                if self.csv_writer is None:
+                    self.csv_writer = csv.DictWriter(self.handle, fieldnames=list(result),
+                                                     extrasaction='ignore')
+                    self.csv_writer.writeheader()
+                self.csv_writer.writerow({key: ' '.join(value) if isinstance(value, list) else value
+                                          for key, value in result.items()})
+            else:
+                self.handle.write(json.dumps(result) + '\n')
+        self.handle.flush()
+
+    def close(self):
+        if self.handle is not sys.stdout:
+            self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def run(input_path, output_path, input_format=None, output_format=None, chunk_size=256,
+        n_process=1, batch_size=32, transcript_field='transcript', tags_field='tags',
+        log=sys.stderr):
+    start = time.perf_counter()
+    total = 0
+    with ResultWriter(output_path, output_format) as writer:
+        pairs = clean_stream(read_records(input_path, input_format), transcript_field,
+                             n_process, batch_size)
+        for chunk in chunked(pairs, chunk_size):
+            records, cleaned = zip(*chunk)
+            writer.write(score_chunk(records, list(cleaned), transcript_field, tags_field))
+            total += len(records)
+            if log is not None:
+                elapsed = time.perf_counter() - start
+                log.write('{} talks scored, {:.1f} talks/s\n'.format(total, total / elapsed))
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('input', help="JSONL or CSV file, '-' for stdin")
+    parser.add_argument('output', help="JSONL or CSV file, '-' for stdout")
+    parser.add_argument('--input-format', choices=('jsonl', 'csv'))
+    parser.add_argument('--output-format', choices=('jsonl', 'csv'))
+    parser.add_argument('--chunk-size', type=int, default=256,
+                        help='talks vectorized and scored together')
+    parser.add_argument('--n-process', type=int, default=1, help='spaCy worker processes')
+    parser.add_argument('--batch-size', type=int, default=32, help='spaCy nlp.pipe batch size')
+    parser.add_argument('--transcript-field', default='transcript')
+    parser.add_argument('--tags-field', default='tags')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args(argv)
+
+    run(args.input, args.output, args.input_format, args.output_format, args.chunk_size,
+        args.n_process, args.batch_size, args.transcript_field, args.tags_field,
+        log=None if args.quiet else sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,211 @@
+'''Benchmark the prediction pipeline stage by stage.
+
+Times the spaCy load, the pickle loads, clean_text, clean_tags, the
+vectorizer/selector transforms, predict_proba and ensemble_prediction on the
+example talk and on synthetic talks of several lengths, and writes p50/p95/p99
+latency, throughput and the growth of the peak RSS per stage as JSON.
+
+    python benchmark.py --output bench.json
+    python benchmark.py --output new.json --baseline bench.json --max-regression 0.2 --min-seconds 0.001
+    python benchmark.py --profile profiles/     # one cProfile .prof file per stage
+'''
+import argparse
+import cProfile
+import json
+import os
+import pickle
+import platform
+import sys
+import time
+
+import numpy as np
+
+from model_registry import ModelRegistry, peak_rss_bytes, registry
+from tag_index import tag_index
+from ted_examples import example_keynote, example_tags
+import ted_pipeline
+
+
+def summarize_samples(samples):
+    samples = np.asarray(samples)
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {
+        'runs': len(samples),
+        'mean': float(samples.mean()),
+        'min': float(samples.min()),
+        'max': float(samples.max()),
+        'p50': float(p50),
+        'p95': float(p95),
+        'p99': float(p99),
+        'throughput_per_s': float(len(samples) / samples.sum()) if samples.sum() else None,
+    }
+
+
+def synthetic_talk(n_words, seed=0):
+    '''a talk of n_words words drawn from the example, in paragraphs like the real transcripts'''
+    rng = np.random.RandomState(seed)
+    words = np.array(example_keynote.split())
+    paragraphs = []
+    remaining = n_words
+    while remaining > 0:
+        size = min(remaining, rng.randint(40, 160))
+        paragraphs.append(' '.join(rng.choice(words, size=size)))
+        if rng.rand() < 0.1:
+            paragraphs.append('(Laughter)')
+        remaining -= size
+    return '\n\n'.join(paragraphs)
+
+
+class Benchmark:
+
+    def __init__(self, repeats=20, warmup=1, profile_dir=None):
+        self.repeats = repeats
+        self.warmup = warmup
+        self.profile_dir = profile_dir
+        self.stages = {}
+
+    def time(self, stage, func, repeats=None, warmup=None):
+        '''run func repeatedly and record its latency under stage; returns the last result'''
+        for _ in range(self.warmup if warmup is None else warmup):
+            result = func()
+        profiler = cProfile.Profile() if self.profile_dir else None
+        peak_before = peak_rss_bytes()
+        samples = []
+        for _ in range(self.repeats if repeats is None else repeats):
+            if profiler:
+                profiler.enable()
+            start = time.perf_counter()
+            result = func()
+            samples.append(time.perf_counter() - start)
+            if profiler:
+                profiler.disable()
+        if profiler:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            profiler.dump_stats(os.path.join(self.profile_dir, stage.replace('/', '_') + '.prof'))
+        self.stages[stage] = summarize_samples(samples)
+        # ru_maxrss only grows, so this is how far the stage raised the process peak
+        self.stages[stage]['peak_rss_growth_bytes'] = peak_rss_bytes() - peak_before
+        return result
+
+
+def _load_pickle(path):
+    with open(path, 'rb') as artifact_file:
+        return pickle.load(artifact_file)
+
+
+def _end_to_end():
+    '''predict() without the clean_text cache and the prediction store'''
+    cleaned = ted_pipeline.clean_text.uncached(example_keynote)
+    trans_pred_proba = ted_pipeline.score('transcript', [cleaned])
+    tags_pred_proba = ted_pipeline.tags_proba(example_tags)
+    return ted_pipeline.ensemble_prediction(trans_pred_proba, tags_pred_proba)
+
+
+def run_benchmarks(lengths=(500, 2000, 8000), repeats=20, load_repeats=3, profile_dir=None):
+    bench = Benchmark(repeats, profile_dir=profile_dir)
+
+    bench.time('load/spacy', lambda: ModelRegistry().nlp(), repeats=load_repeats, warmup=0)
+    for name in registry.artifacts:
+        if registry.exists(name):
+            bench.time('load/' + name, lambda: _load_pickle(registry.path(name)),
+                       repeats=load_repeats, warmup=0)
+
+    talks = {'example': example_keynote}
+    talks.update(('synthetic_{}w'.format(n), synthetic_talk(n, seed=n)) for n in lengths)
+    vectorizer, selector, model = registry.pipeline('transcript')
+    tags_vectorizer, tags_selector, tags_model = registry.pipeline('tags')
+
+    for label, talk in talks.items():
+        cleaned = bench.time('clean_text/' + label,
+                             lambda: ted_pipeline.clean_text.uncached(talk, 'spacy'))
+        if ted_pipeline.PREPROCESSING == 'fast' or registry.exists('lemma_table'):
+            bench.time('clean_text_fast/' + label,
+                       lambda: ted_pipeline.clean_text.uncached(talk, 'fast'))
+        X = bench.time('vectorizer/' + label, lambda: vectorizer.transform([cleaned]))
+        X_sel = bench.time('selector/' + label, lambda: selector.transform(X))
+        bench.time('predict_proba/' + label, lambda: model.predict_proba(X_sel))
+        if registry.exists('transcript_compact'):
+            compact = registry.get('transcript_compact')
+            bench.time('compact_predict_proba/' + label, lambda: compact.predict_proba([cleaned]))
+
+    tags = bench.time('clean_tags/example', lambda: ted_pipeline.clean_tags(example_tags))
+    bench.time('clean_tags_bulk/1000', lambda: tag_index().documents([example_tags] * 1000))
+    X_tags = bench.time('tags_vectorizer/example', lambda: tags_vectorizer.transform([' '.join(tags)]))
+    X_sel_tags = bench.time('tags_selector/example', lambda: tags_selector.transform(X_tags))
+    tags_pred_proba = bench.time('tags_predict_proba/example',
+                                 lambda: tags_model.predict_proba(X_sel_tags))
+    trans_pred_proba = ted_pipeline.transcript_proba(example_keynote)
+    bench.time('ensemble_prediction/example',
+               lambda: ted_pipeline.ensemble_prediction(trans_pred_proba, tags_pred_proba))
+    bench.time('end_to_end/example', _end_to_end)
+
+    return {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'preprocessing': ted_pipeline.PREPROCESSING,
+            'model_format': ted_pipeline.MODEL_FORMAT,
+            'repeats': repeats,
+            'load_repeats': load_repeats,
+            'lengths': list(lengths),
+            'process_peak_rss_bytes': peak_rss_bytes(),
+        },
+        'stages': bench.stages,
+    }
+
+
+def compare(results, baseline, metric='p50', max_regression=0.2, min_seconds=0.001):
+    '''stages whose metric got more than max_regression (a fraction) and min_seconds slower'''
+    regressions = []
+    for stage, stats in results['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if previous is None or not previous.get(metric):
+            continue
+        ratio = stats[metric] / previous[metric]
+        if ratio > 1 + max_regression and stats[metric] - previous[metric] > min_seconds:
+            regressions.append({'stage': stage, 'metric': metric, 'baseline': previous[metric],
+                                'current': stats[metric], 'ratio': ratio})
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--output', default='-', help="JSON results, '-' for stdout")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--load-repeats', type=int, default=3,
+                        help='repeats for the spaCy and pickle loads')
+    parser.add_argument('--lengths', type=int, nargs='*', default=[500, 2000, 8000],
+                        help='word counts of the synthetic talks')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='write a cProfile file per stage (view with snakeviz or flameprof)')
+    parser.add_argument('--baseline', help='earlier results to compare against')
+    parser.add_argument('--metric', default='p50', choices=('mean', 'p50', 'p95', 'p99'))
+    parser.add_argument('--max-regression', type=float, default=0.2,
+                        help='allowed slowdown per stage, as a fraction of the baseline')
+    parser.add_argument('--min-seconds', type=float, default=0.001,
+                        help='slowdowns smaller than this never count as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.lengths, args.repeats, args.load_repeats, args.profile)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.metric,
+                                  args.max_regression, args.min_seconds)
+        results['regressions'] = regressions
+
+    output = json.dumps(results, indent=2)
+    if args.output == '-':
+        print(output)
+    else:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    for regression in regressions:
+        sys.stderr.write('{stage}: {metric} {baseline:.6f}s -> {current:.6f}s ({ratio:.2f}x)\n'
+                         .format(**regression))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
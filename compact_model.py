@@ -0,0 +1,221 @@
+'''Compact inference artifacts.
+
+Folds a fitted vectorizer, its SelectKBest selector and the LogisticRegression
+behind it into a single CompactScorer that only keeps what predict_proba
+needs: the selected terms with their idf weights and coefficients. The chi2
+scores and p-values of the selector and the vectorizer's stop_words_ set are
+dropped. With an l2/l1-normalized TfidfVectorizer the row norm runs over the
+whole vocabulary, so in that case the other terms are kept too, but only as
+idf weights for the norm.
+
+Export (needs scikit-learn) and check parity against the original pickles:
+
+    python compact_model.py
+'''
+import argparse
+import pickle
+import re
+import sys
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+
+FORMAT_VERSION = 1
+
+
+class CompactScorer:
+    '''vectorizer -> selector -> predict_proba on a pruned vocabulary'''
+
+    def __init__(self, state):
+        self.__setstate__(state)
+
+    def __getstate__(self):
+        return self.state
+
+    def __setstate__(self, state):
+        if state.get('format') != FORMAT_VERSION:
+            raise ValueError('unsupported compact artifact format: {}'.format(state.get('format')))
+        self.state = state
+        self.terms = state['terms']
+        self.n_selected = state['n_selected']
+        self.index = {term: i for i, term in enumerate(self.terms)}
+        self.token_re = re.compile(state['token_pattern'])
+        self.stop_words = state['stop_words']
+        self.idf = state['idf']
+        self.coef = state['coef']
+        self.intercept = state['intercept']
+        self.classes_ = state['classes']
+
+    @property
+    def selected_terms(self):
+        return self.terms[:self.n_selected]
+
+    def analyze(self, doc):
+        '''the word analyzer of CountVectorizer for a string-only configuration'''
+        if self.state['lowercase']:
+            doc = doc.lower()
+        tokens = self.token_re.findall(doc)
+        if self.stop_words:
+            tokens = [token for token in tokens if token not in self.stop_words]
+        min_n, max_n = self.state['ngram_range']
+        if max_n == 1:
+            return tokens
+        # a copy: the n-grams below are built from the original tokens only
+        ngrams = list(tokens) if min_n == 1 else []
+        for n in range(max(min_n, 2), min(max_n, len(tokens)) + 1):
+            ngrams.extend(' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1))
+        return ngrams
+
+    def count(self, docs):
+        '''raw term counts over the kept terms; counts of several chunks of a document add up'''
+        index = self.index
+        indices, data, indptr = [], [], [0]
+        for doc in docs:
+            counts = Counter(index[term] for term in self.analyze(doc) if term in index)
+            indices.extend(counts.keys())
+            data.extend(counts.values())
+            indptr.append(len(indices))
+        X = sp.csr_matrix((np.asarray(data, dtype=np.float64),
+                           np.asarray(indices, dtype=np.int32),
+                           np.asarray(indptr, dtype=np.int32)),
+                          shape=(len(indptr) - 1, len(self.terms)))
+        X.sort_indices()
+        return X
+
+    def weight(self, counts):
+        '''tf-idf weighting, normalization and feature selection of raw counts'''
+        X = sp.csr_matrix(counts, dtype=np.float64, copy=True)
+        if self.state['binary']:
+            X.data.fill(1)
+        if self.state['sublinear_tf']:
+            np.log(X.data, X.data)
+            X.data += 1
+        if self.idf is not None:
+            X.data *= self.idf[X.indices]
+        norm = self.state['norm']
+        if norm is not None and X.nnz:
+            if norm == 'l2':
+                norms = np.sqrt(np.asarray(X.multiply(X).sum(axis=1)).ravel())
+            else:
+                norms = np.asarray(abs(X).sum(axis=1)).ravel()
+            norms[norms == 0] = 1
+            X.data /= np.repeat(norms, np.diff(X.indptr))
+        return X[:, :self.n_selected]
+
+    def transform(self, docs):
+        '''same matrix as selector.transform(vectorizer.transform(docs))'''
+        return self.weight(self.count(docs))
+
+    def predict_proba_counts(self, counts):
+        return self._proba(self.weight(counts).dot(self.coef) + self.intercept)
+
+    def decision_function(self, docs):
+        return self.transform(docs).dot(self.coef) + self.intercept
+
+    def predict_proba(self, docs):
+        return self._proba(self.decision_function(docs))
+
+    def _proba(self, decision):
+        if self.state['multinomial']:
+            # softmax over (-d, d), as LogisticRegression does for two classes
+            positive = 1 / (1 + np.exp(-2 * decision))
+        else:
+            positive = 1 / (1 + np.exp(-decision))
+        return np.column_stack([1 - positive, positive])
+
+    def predict(self, docs):
+        return self.classes_[(self.decision_function(docs) > 0).astype(int)]
+
+
+def export_compact(vectorizer, selector, model):
+    '''fold a fitted vectorizer, selector and binary LogisticRegression into a CompactScorer'''
+    if vectorizer.analyzer != 'word' or vectorizer.tokenizer is not None \
+            or vectorizer.preprocessor is not None or vectorizer.strip_accents is not None:
+        raise ValueError('only the default word analyzer can be exported')
+    if len(model.classes_) != 2:
+        raise ValueError('only binary models can be exported')
+
+    support = selector.get_support()
+    selected = np.flatnonzero(support)
+    norm = getattr(vectorizer, 'norm', None)
+    if norm is None:
+        kept = selected
+    else:
+        kept = np.concatenate([selected, np.flatnonzero(~support)])
+
+    terms_by_column = np.empty(len(vectorizer.vocabulary_), dtype=object)
+    for term, column in vectorizer.vocabulary_.items():
+        terms_by_column[column] = term
+    idf = getattr(vectorizer, 'idf_', None) if getattr(vectorizer, 'use_idf', False) else None
+    stop_words = vectorizer.get_stop_words()
+
+    return CompactScorer({
+        'format': FORMAT_VERSION,
+        'terms': list(terms_by_column[kept]),
+        'n_selected': len(selected),
+        'idf': None if idf is None else np.asarray(idf, dtype=np.float64)[kept],
+        'coef': np.asarray(model.coef_[0], dtype=np.float64),
+        'intercept': float(model.intercept_[0]),
+        'classes': np.asarray(model.classes_),
+        # 'auto' resolves to one-vs-rest for two classes
+        'multinomial': getattr(model, 'multi_class', 'ovr') == 'multinomial',
+        'lowercase': vectorizer.lowercase,
+        'token_pattern': vectorizer.token_pattern,
+        'stop_words': frozenset(stop_words) if stop_words else None,
+        'ngram_range': tuple(vectorizer.ngram_range),
+        'binary': vectorizer.binary,
+        'sublinear_tf': getattr(vectorizer, 'sublinear_tf', False),
+        'norm': norm,
+    })
+
+
+def parity_documents(vectorizer, n_docs=200, seed=0):
+    '''synthetic documents drawn from the vocabulary, mixed with unknown words'''
+    rng = np.random.RandomState(seed)
+    vocabulary = np.array(sorted(vectorizer.vocabulary_))
+    docs = ['', 'zzzunknownzzz']
+    for _ in range(n_docs):
+        words = list(rng.choice(vocabulary, size=rng.randint(1, 300)))
+        words += ['unknownword{}'.format(i) for i in range(rng.randint(0, 5))]
+        docs.append(' '.join(words))
+    return docs
+
+
+def check_parity(scorer, vectorizer, selector, model, docs, atol=1e-9):
+    '''largest absolute difference in predict_proba; raises if it exceeds atol'''
+    expected = model.predict_proba(selector.transform(vectorizer.transform(docs)))
+    actual = scorer.predict_proba(docs)
+    difference = float(np.max(np.abs(expected - actual))) if len(docs) else 0.0
+    if difference > atol:
+        raise AssertionError('compact scorer deviates by {:.3g} from the original pipeline'.format(
+            difference))
+    return difference
+
+
+def main(argv=None):
+    from model_registry import registry
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('prefixes', nargs='*', default=['transcript', 'tags'])
+    parser.add_argument('--atol', type=float, default=1e-9)
+    parser.add_argument('--no-check', action='store_true', help='skip the parity check')
+    args = parser.parse_args(argv)
+
+    for prefix in args.prefixes:
+        vectorizer, selector, model = registry.pipeline(prefix)
+        scorer = export_compact(vectorizer, selector, model)
+        if not args.no_check:
+            difference = check_parity(scorer, vectorizer, selector, model,
+                                      parity_documents(vectorizer), atol=args.atol)
+            print('{}: parity ok (max |diff| = {:.3g})'.format(prefix, difference))
+        path = registry.path(prefix + '_compact')
+        with open(path, 'wb') as compact_file:
+            pickle.dump(scorer, compact_file, protocol=pickle.HIGHEST_PROTOCOL)
+        print('{}: wrote {} ({} of {} terms, {} selected)'.format(
+            prefix, path, len(scorer.terms), len(vectorizer.vocabulary_), scorer.n_selected))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+'''Fast preprocessing backend for clean_text.
+
+The spaCy backend runs tok2vec, tagger and lemmatizer over the whole
+transcript just to keep NOUN/VERB/ADJ/ADV/PROPN lemmas. The fast backend only
+runs spaCy's rule-based English tokenizer and looks every token up in a
+precomputed surface form -> lemma table. The table is built once by running
+the full pipeline over a corpus, keeping for each lower-cased surface form its
+most frequent outcome, and only for lemmas the transcript vectorizer knows:
+everything else never reaches the model anyway. Tokens missing from the table
+are skipped. Without a table the backend falls back to exact vocabulary
+matches, with a warning.
+
+    python fast_lemmatizer.py build talks.jsonl       # writes ted_lemma_table.pkl
+    python fast_lemmatizer.py report talks.jsonl      # how often the prediction changes
+'''
+import argparse
+import json
+import pickle
+import sys
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from model_registry import registry
+from ted_examples import example_keynote, example_tags
+
+
+def transcript_vocabulary():
+    '''every term that influences the transcript model, selected or only part of the norm'''
+    if registry.exists('transcript_compact'):
+        return set(registry.get('transcript_compact').terms)
+    return set(registry.get('transcript_vectorizer').vocabulary_)
+
+
+def build_lemma_table(texts, vocabulary=None, n_process=1, batch_size=32):
+    '''surface form -> lemma for the content words of texts whose lemma is in vocabulary'''
+    from ted_pipeline import CONTENT_POS
+
+    vocabulary = transcript_vocabulary() if vocabulary is None else set(vocabulary)
+    outcomes = defaultdict(Counter)
+    for doc in registry.nlp().pipe(texts, n_process=n_process, batch_size=batch_size):
+        for token in doc:
+            if token.is_space:
+                continue
+            lemma = token.lemma_.lower() if token.pos_ in CONTENT_POS else None
+            outcomes[token.lower_][lemma] += 1
+
+    table = {}
+    for surface, counts in outcomes.items():
+        lemma = counts.most_common(1)[0][0]
+        if lemma is not None and lemma in vocabulary:
+            table[surface] = lemma
+    # terms never seen in the corpus still map to themselves
+    for term in vocabulary:
+        if term not in outcomes:
+            table[term] = term
+    return table
+
+
+class FastLemmatizer:
+    '''clean_text on a tokenizer and a lemma table instead of the full pipeline'''
+
+    def __init__(self, table):
+        import spacy
+
+        self.table = table
+        self.tokenizer = spacy.blank('en').tokenizer
+
+    def _lemmas(self, doc):
+        table = self.table
+        lemmas = (table.get(token.lower_) for token in doc)
+        return ' '.join(lemma for lemma in lemmas if lemma is not None)
+
+    def clean(self, text):
+        return self._lemmas(self.tokenizer(text))
+
+    def pipe(self, texts, batch_size=1000):
+        for doc in self.tokenizer.pipe(texts, batch_size=batch_size):
+            yield self._lemmas(doc)
+
+
+_lemmatizer = {}
+
+
+def fast_lemmatizer():
+    '''the shared FastLemmatizer, rebuilt when the lemma table is reloaded'''
+    if registry.exists('lemma_table'):
+        table = registry.get('lemma_table')
+    else:
+        table = _lemmatizer.get('seed_table')
+        if table is None:
+            # warned once per process, while the fallback table is built
+            sys.stderr.write('{} not found: the fast backend only keeps exact vocabulary terms, '
+                             'without lemmatization; build it with "python fast_lemmatizer.py '
+                             'build"\n'.format(registry.path('lemma_table')))
+            table = _lemmatizer['seed_table'] = {term: term for term in transcript_vocabulary()}
+    lemmatizer = _lemmatizer.get('lemmatizer')
+    if lemmatizer is None or lemmatizer.table is not table:
+        lemmatizer = _lemmatizer['lemmatizer'] = FastLemmatizer(table)
+    return lemmatizer
+
+
+def agreement_report(talks, n_process=1, batch_size=32):
+    '''compare the spacy and fast backends on (transcript, tags) pairs'''
+    from ted_pipeline import clean_texts, predict_cleaned
+
+    transcripts = [transcript for transcript, _ in talks]
+    tags = [talk_tags for _, talk_tags in talks]
+    report = {'talks': len(talks), 'seconds': {}}
+    summaries = {}
+    for backend in ('spacy', 'fast'):
+        start = time.perf_counter()
+        cleaned = list(clean_texts(transcripts, n_process=n_process, batch_size=batch_size,
+                                   backend=backend))
+        report['seconds'][backend] = time.perf_counter() - start
+        summaries[backend] = predict_cleaned(cleaned, tags)
+
+    def column(backend, key):
+        return np.array([summary[key] for summary in summaries[backend]])
+
+    transcript_diff = np.abs(column('spacy', 'transcript_proba') - column('fast', 'transcript_proba'))
+    changed = column('spacy', 'prediction') != column('fast', 'prediction')
+    report.update({
+        'speedup': report['seconds']['spacy'] / max(report['seconds']['fast'], 1e-9),
+        'prediction_agreement': float(1 - changed.mean()) if len(talks) else 1.0,
+        'predictions_changed': int(changed.sum()),
+        'transcript_proba_mean_abs_diff': float(transcript_diff.mean()) if len(talks) else 0.0,
+        'transcript_proba_max_abs_diff': float(transcript_diff.max()) if len(talks) else 0.0,
+    })
+    return report
+
+
+def _talks(path, transcript_field, tags_field):
+    if path is None:
+        return [(example_keynote, example_tags)]
+    from batch_predict import read_records, tags_text
+    return [(record.get(transcript_field) or '', tags_text(record.get(tags_field)))
+            for record in read_records(path)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('command', choices=('build', 'report'))
+    parser.add_argument('input', nargs='?',
+                        help='JSONL or CSV file of talks (default: the example talk)')
+    parser.add_argument('--transcript-field', default='transcript')
+    parser.add_argument('--tags-field', default='tags')
+    parser.add_argument('--n-process', type=int, default=1)
+    parser.add_argument('--batch-size', type=int, default=32)
+    args = parser.parse_args(argv)
+
+    talks = _talks(args.input, args.transcript_field, args.tags_field)
+    if args.command == 'build':
+        table = build_lemma_table((transcript for transcript, _ in talks),
+                                  n_process=args.n_process, batch_size=args.batch_size)
+        path = registry.path('lemma_table')
+        with open(path, 'wb') as table_file:
+            pickle.dump(table, table_file, protocol=pickle.HIGHEST_PROTOCOL)
+        print('wrote {} ({} surface forms)'.format(path, len(table)))
+    else:
+        print(json.dumps(agreement_report(talks, args.n_process, args.batch_size), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+'''Process-wide registry for the pickled models and the spaCy pipeline.
+
+Streamlit re-executes ted_app.py on every widget interaction, but imported
+modules stay in sys.modules, so everything held here is loaded once per
+worker process and shared by all sessions and reruns.
+'''
+import os
+import pickle
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+SPACY_MODEL = 'en_core_web_md'
+SPACY_DISABLE = ('parser', 'ner')
+
+ARTIFACTS = {
+    'transcript_vectorizer': 'ted_X_transcript_vectorizer.pkl',
+    'transcript_selector': 'ted_X_transcript_selector.pkl',
+    'transcript_model': 'ted_transcript.pkl',
+    'tags_vectorizer': 'ted_X_tags_vectorizer.pkl',
+    'tags_selector': 'ted_X_tags_selector.pkl',
+    'tags_model': 'ted_tags.pkl',
+    # written by compact_model.py
+    'transcript_compact': 'ted_transcript_compact.pkl',
+    'tags_compact': 'ted_tags_compact.pkl',
+    # written by fast_lemmatizer.py
+    'lemma_table': 'ted_lemma_table.pkl',
+}
+
+# attributes every artifact of a given kind has to provide
+REQUIRED_ATTRIBUTES = {
+    'vectorizer': ('transform', 'vocabulary_'),
+    'selector': ('transform', 'get_support'),
+    'model': ('predict_proba', 'classes_', 'coef_'),
+    'compact': ('predict_proba', 'selected_terms'),
+}
+
+
+class ArtifactError(Exception):
+    '''raised when an artifact is missing or does not look like what we expect'''
+
+
+def rss_bytes():
+    '''current resident set size of this process, or None without /proc'''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def peak_rss_bytes():
+    '''peak resident set size of this process so far'''
+    import resource
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _rss_delta(before):
+    after = rss_bytes()
+    return None if before is None or after is None else after - before
+
+
+def validate_artifact(name, obj):
+    kind = name.rsplit('_', 1)[-1]
+    missing = [attr for attr in REQUIRED_ATTRIBUTES.get(kind, ())
+               if not hasattr(obj, attr)]
+    if missing:
+        raise ArtifactError('{} ({}) is missing {}'.format(
+            name, type(obj).__name__, ', '.join(missing)))
+
+
+def validate_pipeline(vectorizer, selector, model, prefix=''):
+    '''check that vectorizer -> selector -> model line up dimension-wise'''
+    n_vocabulary = len(vectorizer.vocabulary_)
+    support = selector.get_support()
+    if len(support) != n_vocabulary:
+        raise ArtifactError('{} selector expects {} features, vectorizer has {}'.format(
+            prefix, len(support), n_vocabulary))
+    if model.coef_.shape[1] != support.sum():
+        raise ArtifactError('{} model expects {} features, selector keeps {}'.format(
+            prefix, model.coef_.shape[1], support.sum()))
+
+
+class ModelRegistry:
+    '''Loads every artifact once, validates it and reloads it when the file changes.
+
+    check_interval is the minimum number of seconds between two stat() calls
+    for the same artifact; set it to None to disable hot-reloading.
+    generation is bumped whenever an already loaded artifact is reloaded and
+    on clear(), so callers can invalidate anything they derived from the
+    artifacts; first loads leave it alone.
+    '''
+
+    def __init__(self, artifacts=ARTIFACTS, base_dir=BASE_DIR, check_interval=2.0):
+        self.artifacts = dict(artifacts)
+        self.base_dir = base_dir
+        self.check_interval = check_interval
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._nlp = {}
+        self._metrics = {}
+        self._validated = {}
+        self.generation = 0
+
+    def path(self, name):
+        try:
+            filename = self.artifacts[name]
+        except KeyError:
+            raise ArtifactError('unknown artifact: {}'.format(name))
+        return os.path.join(self.base_dir, filename)
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def _signature(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError as error:
+            raise ArtifactError('cannot read {}: {}'.format(path, error))
+        return stat.st_mtime_ns, stat.st_size
+
+    def _load(self, name, path, signature):
+        rss_before = rss_bytes()
+        start = time.perf_counter()
+        with open(path, 'rb') as artifact_file:
+            obj = pickle.load(artifact_file)
+        load_seconds = time.perf_counter() - start
+        validate_artifact(name, obj)
+        previous = self._metrics.get(name, {})
+        self._metrics[name] = {
+            'path': path,
+            'size_bytes': signature[1],
+            'load_seconds': load_seconds,
+            'rss_delta_bytes': _rss_delta(rss_before),
+            'loaded_at': time.time(),
+            'loads': previous.get('loads', 0) + 1,
+        }
+        return obj
+
+    def get(self, name):
+        '''return the artifact, loading it on first use or when it changed on disk'''
+        entry = self._entries.get(name)
+        now = time.monotonic()
+        if entry is not None and (self.check_interval is None
+                                  or now - entry['checked'] < self.check_interval):
+            return entry['obj']
+        with self._lock:
+            entry = self._entries.get(name)
+            path = self.path(name)
+            signature = self._signature(path)
+            if entry is None or entry['signature'] != signature:
+                reload = entry is not None
+                entry = {'obj': self._load(name, path, signature), 'signature': signature}
+                self._entries[name] = entry
+                if reload:
+                    self.generation += 1
+            entry['checked'] = now
+            return entry['obj']
+
+    def pipeline(self, prefix):
+        '''(vectorizer, selector, model) for 'transcript' or 'tags', checked for consistency'''
+        vectorizer = self.get(prefix + '_vectorizer')
+        selector = self.get(prefix + '_selector')
+        model = self.get(prefix + '_model')
+        if self._validated.get(prefix) != self.generation:
+            validate_pipeline(vectorizer, selector, model, prefix)
+            self._validated[prefix] = self.generation
+        return vectorizer, selector, model
+
+    def nlp(self, model=SPACY_MODEL, disable=SPACY_DISABLE):
+        '''the shared spaCy pipeline'''
+        key = (model, tuple(disable))
+        if key not in self._nlp:
+            with self._lock:
+                if key not in self._nlp:
+                    import spacy
+                    rss_before = rss_bytes()
+                    start = time.perf_counter()
+                    self._nlp[key] = spacy.load(model, disable=list(disable))
+                    self._metrics['spacy:' + model] = {
+                        'disable': list(disable),
+                        'load_seconds': time.perf_counter() - start,
+                        'rss_delta_bytes': _rss_delta(rss_before),
+                        'loaded_at': time.time(),
+                        'loads': 1,
+                    }
+        return self._nlp[key]
+
+    def load_all(self):
+        '''eagerly load everything, e.g. to warm up a worker before serving'''
+        self.nlp()
+        for prefix in ('transcript', 'tags'):
+            self.pipeline(prefix)
+        return self.metrics()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nlp.clear()
+            self._validated.clear()
+            self.generation += 1
+
+    def metrics(self):
+        '''load time and memory cost per artifact, plus the current and peak process RSS'''
+        with self._lock:
+            artifacts = {name: dict(values) for name, values in self._metrics.items()}
+        return {
+            'artifacts': artifacts,
+            'total_load_seconds': sum(m['load_seconds'] for m in artifacts.values()),
+            'rss_bytes': rss_bytes(),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'pid': os.getpid(),
+        }
+
+
+registry = ModelRegistry()
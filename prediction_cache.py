@@ -0,0 +1,97 @@
+'''Bounded LRU/TTL cache keyed on a hash of the normalized input text.'''
+import functools
+import hashlib
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+
+def normalize_text(text):
+    '''unicode-normalize, unify line endings and strip trailing whitespace per line'''
+    text = unicodedata.normalize('NFC', text or '')
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.rstrip() for line in lines).strip()
+
+
+def text_key(text):
+    '''content hash used as cache key, so large transcripts are not kept twice'''
+    return hashlib.sha1(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class LRUCache:
+    '''Thread-safe least-recently-used cache with an optional time-to-live.
+
+    maxsize bounds the number of entries, ttl (seconds) the age of an entry;
+    ttl=None keeps entries until they are evicted.
+    '''
+
+    def __init__(self, maxsize=128, ttl=None):
+        if maxsize < 1:
+            raise ValueError('maxsize must be at least 1')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl is not None \
+                    and time.monotonic() - item[1] > self.ttl:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+_MISSING = object()
+
+
+def memoize(cache, key):
+    '''cache the results of func in cache, under key(*args, **kwargs)'''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key = key(*args, **kwargs)
+            value = cache.get(cache_key, _MISSING)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                cache.set(cache_key, value)
+            return value
+        wrapper.cache = cache
+        wrapper.uncached = func
+        return wrapper
+    return decorator
@@ -0,0 +1,289 @@
+'''Precomputed predictions for the known TED corpus.
+
+An offline build runs the regular pipeline over the Kaggle TED dataset and
+writes transcript probability, tags probability and the ensemble outcome of
+every talk to a SQLite file. Talks can then be looked up by URL, by title, by
+a hash of the pasted transcript or by a hash of its cleaned text, instead of
+running spaCy and the models again.
+
+    python prediction_store.py build ted_main.csv transcripts.csv
+    python prediction_store.py build talks.jsonl      # url, title, transcript, tags
+    python prediction_store.py lookup https://www.ted.com/talks/matt_walker_sleep_is_your_superpower
+
+The store records a signature of the model files and of the preprocessing
+backend it was built with and is ignored when they no longer match.
+'''
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+from model_registry import BASE_DIR, registry
+from prediction_cache import text_key
+
+STORE_PATH = os.environ.get('TED_PREDICTION_STORE',
+                            os.path.join(BASE_DIR, 'ted_predictions.sqlite'))
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS talks (
+    id INTEGER PRIMARY KEY,
+    url TEXT,
+    url_key TEXT,
+    title TEXT,
+    title_key TEXT,
+    text_hash TEXT,
+    clean_hash TEXT,
+    tags_hash TEXT,
+    transcript_proba REAL,
+    tags_proba REAL,
+    popular_proba REAL,
+    prediction INTEGER,
+    popularity TEXT,
+    unknown_tags TEXT
+);
+CREATE INDEX IF NOT EXISTS talks_url_key ON talks (url_key);
+CREATE INDEX IF NOT EXISTS talks_title_key ON talks (title_key);
+CREATE INDEX IF NOT EXISTS talks_text_hash ON talks (text_hash);
+CREATE INDEX IF NOT EXISTS talks_clean_hash ON talks (clean_hash);
+'''
+
+SUMMARY_COLUMNS = ('transcript_proba', 'tags_proba', 'popular_proba', 'prediction', 'popularity')
+
+
+def url_key(url):
+    '''scheme, www., query string and trailing slashes do not matter'''
+    url = (url or '').strip().lower()
+    url = re.sub(r'^[a-z]+://', '', url)
+    url = re.sub(r'^www\.', '', url)
+    return url.split('?')[0].split('#')[0].rstrip('/')
+
+
+def title_key(title):
+    return ' '.join((title or '').lower().split())
+
+
+def _file_signature(path):
+    '''(mtime, size) of path, or None when it does not exist'''
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+# path -> (file signature, SHA-1 of the contents)
+_file_digests = {}
+
+
+def _file_digest(path):
+    '''SHA-1 of a file, only read again when its mtime or size changed'''
+    signature = _file_signature(path)
+    if signature is None:
+        return None
+    cached = _file_digests.get(path)
+    if cached is None or cached[0] != signature:
+        digest = hashlib.sha1()
+        with open(path, 'rb') as artifact_file:
+            for block in iter(lambda: artifact_file.read(1 << 20), b''):
+                digest.update(block)
+        cached = _file_digests[path] = (signature, digest.hexdigest())
+    return cached[1]
+
+
+def model_signature(preprocessing):
+    '''hash of the original model files, the preprocessing backend and its lemma table'''
+    digest = hashlib.sha1(preprocessing.encode('utf-8'))
+    names = ['{}_{}'.format(prefix, kind) for prefix in ('transcript', 'tags')
+             for kind in ('vectorizer', 'selector', 'model')]
+    if preprocessing == 'fast':
+        names.append('lemma_table')
+    for name in names:
+        file_digest = _file_digest(registry.path(name))
+        if file_digest is not None:
+            digest.update(file_digest.encode('ascii'))
+    return digest.hexdigest()
+
+
+class PredictionStore:
+    '''read access to a built store; every lookup returns a summary dict or None'''
+
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        self._connection = sqlite3.connect('file:{}?mode=ro'.format(path), uri=True,
+                                           check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._connection.execute('PRAGMA mmap_size = 268435456')
+        self._lock = threading.Lock()
+        self.closed = False
+        self.meta = dict(self._connection.execute('SELECT key, value FROM meta'))
+
+    def matches(self, preprocessing):
+        return self.meta.get('model_signature') == model_signature(preprocessing)
+
+    def _one(self, column, value):
+        with self._lock:
+            if self.closed:
+                # replaced by a newer store while this session still held it
+                return None
+            row = self._connection.execute(
+                'SELECT * FROM talks WHERE {} = ? LIMIT 1'.format(column), (value,)).fetchone()
+        if row is None:
+            return None
+        summary = dict(row)
+        summary['unknown_tags'] = json.loads(summary['unknown_tags'] or '[]')
+        return summary
+
+    def by_url(self, url):
+        return self._one('url_key', url_key(url))
+
+    def by_title(self, title):
+        return self._one('title_key', title_key(title))
+
+    def by_talk(self, url_or_title):
+        return self.by_url(url_or_title) or self.by_title(url_or_title)
+
+    def by_transcript(self, transcript):
+        return self._one('text_hash', text_key(transcript))
+
+    def by_clean_text(self, cleaned):
+        return self._one('clean_hash', text_key(cleaned))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM talks').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            self._connection.close()
+
+
+_store = {}
+_store_lock = threading.Lock()
+
+
+def prediction_store(preprocessing):
+    '''the shared store, or None when there is none or it was built for other models'''
+    # re-checked after every model reload and whenever the store file is (re)built
+    key = (preprocessing, registry.generation, _file_signature(STORE_PATH))
+    store = _store.get(key)
+    if store is not None or key in _store:
+        return store
+    with _store_lock:
+        if key in _store:
+            return _store[key]
+        if key[2] is not None:
+            store = PredictionStore(STORE_PATH)
+            if not store.matches(preprocessing):
+                sys.stderr.write('ignoring {}: built for other models\n'.format(STORE_PATH))
+                store.close()
+                store = None
+        for replaced in _store.values():
+            if replaced is not None:
+                replaced.close()
+        _store.clear()
+        _store[key] = store
+    return store
+
+
+def kaggle_talks(main_csv, transcripts_csv):
+    '''url, title, transcript and tags of every talk of the Kaggle TED dataset with a transcript'''
+    import csv
+
+    csv.field_size_limit(sys.maxsize)
+    with open(transcripts_csv, newline='', encoding='utf-8') as transcripts_file:
+        transcripts = {url_key(row['url']): row['transcript']
+                       for row in csv.DictReader(transcripts_file)}
+    with open(main_csv, newline='', encoding='utf-8') as main_file:
+        for row in csv.DictReader(main_file):
+            transcript = transcripts.get(url_key(row['url']))
+            if transcript:
+                yield {'url': row['url'].strip(), 'title': row['title'],
+                       'transcript': transcript, 'tags': row['tags']}
+
+
+def build(talks, path=STORE_PATH, preprocessing=None, n_process=1, batch_size=32,
+          chunk_size=256, log=sys.stderr):
+    '''run the pipeline over talks and write the store to path, replacing it'''
+    from batch_predict import chunked, clean_stream, tags_text
+    import ted_pipeline
+
+    preprocessing = preprocessing or ted_pipeline.PREPROCESSING
+    temporary = path + '.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    connection = sqlite3.connect(temporary)
+    connection.executescript(SCHEMA)
+    start = time.perf_counter()
+    total = 0
+    pairs = clean_stream(talks, 'transcript', n_process, batch_size, backend=preprocessing)
+    for chunk in chunked(pairs, chunk_size):
+        records, cleaned = zip(*chunk)
+        tags = [tags_text(record.get('tags')) for record in records]
+        summaries = ted_pipeline.predict_cleaned(cleaned, tags)
+        connection.executemany(
+            'INSERT INTO talks (url, url_key, title, title_key, text_hash, clean_hash, tags_hash, '
+            'transcript_proba, tags_proba, popular_proba, prediction, popularity, unknown_tags) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(record.get('url'), url_key(record.get('url')),
+              record.get('title'), title_key(record.get('title')),
+              text_key(record.get('transcript')), text_key(clean), text_key(talk_tags))
+             + tuple(summary[column] for column in SUMMARY_COLUMNS)
+             + (json.dumps(summary['unknown_tags']),)
+             for record, clean, talk_tags, summary in zip(records, cleaned, tags, summaries)])
+        connection.commit()
+        total += len(records)
+        if log is not None:
+            log.write('{} talks stored, {:.1f} talks/s\n'.format(
+                total, total / (time.perf_counter() - start)))
+    connection.executemany('INSERT INTO meta (key, value) VALUES (?, ?)', [
+        ('model_signature', model_signature(preprocessing)),
+        ('preprocessing', preprocessing),
+        ('built_at', str(time.time())),
+        ('talks', str(total)),
+    ])
+    connection.commit()
+    connection.execute('VACUUM')
+    connection.close()
+    os.replace(temporary, path)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('inputs', nargs='+',
+                              help='ted_main.csv and transcripts.csv, or one JSONL/CSV of talks')
+    build_parser.add_argument('--output', default=STORE_PATH)
+    build_parser.add_argument('--n-process', type=int, default=1)
+    build_parser.add_argument('--batch-size', type=int, default=32)
+    lookup_parser = subparsers.add_parser('lookup')
+    lookup_parser.add_argument('talk', help='URL or title of a talk')
+    lookup_parser.add_argument('--store', default=STORE_PATH)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        if len(args.inputs) == 2:
+            talks = kaggle_talks(*args.inputs)
+        else:
+            from batch_predict import read_records
+            talks = read_records(args.inputs[0])
+        build(talks, args.output, n_process=args.n_process, batch_size=args.batch_size)
+    elif args.command == 'lookup':
+        summary = PredictionStore(args.store).by_talk(args.talk)
+        print(json.dumps(summary, indent=2))
+        return 0 if summary else 1
+    else:
+        parser.print_help()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,89 @@
+'''Tag normalization against the vocabulary of the tags vectorizer.
+
+Tags come one per line (or comma separated) and may consist of several words.
+Every segment is one tag: its words are joined with "_", as the vocabulary
+spells multi-word tags, so "medical research" becomes the known tag
+"medical_research", and the result is split into tokens with the vectorizer's
+token_pattern, exactly as the vectorizer will split it ("self-help" yields
+"self" and "help"). Tokens outside the vocabulary, and segments the
+token_pattern drops entirely such as "3", are reported as unknown tags
+instead of being dropped silently; they never reach the model.
+'''
+import re
+from collections import namedtuple
+
+from model_registry import registry
+
+# tags are separated by line breaks, commas, semicolons or runs of whitespace
+SEPARATOR = re.compile(r'[\n\r,;]+|\s{2,}|\t')
+# CountVectorizer's default
+TOKEN_PATTERN = r'(?u)\b\w\w+\b'
+
+NormalizedTags = namedtuple('NormalizedTags', ['tags', 'known', 'unknown'])
+
+
+class TagIndex:
+    '''maps tag segments such as 'medical research' to vocabulary tags'''
+
+    def __init__(self, vocabulary, token_pattern=TOKEN_PATTERN):
+        self.token_re = re.compile(token_pattern)
+        self.vocabulary = frozenset(vocabulary)
+
+    def __contains__(self, tag):
+        return tag in self.vocabulary
+
+    def _segment(self, tag):
+        tokens = self.token_re.findall(tag)
+        if not tokens:
+            return [tag], [], [tag]
+        known = [token for token in tokens if token in self.vocabulary]
+        unknown = [token for token in tokens if token not in self.vocabulary]
+        return tokens, known, unknown
+
+    def normalize(self, tags, _segments=None):
+        '''NormalizedTags for one tag string; linear in its length'''
+        result = NormalizedTags([], [], [])
+        for segment in SEPARATOR.split((tags or '').lower()):
+            tag = '_'.join(segment.split())
+            if not tag:
+                continue
+            parts = None if _segments is None else _segments.get(tag)
+            if parts is None:
+                parts = self._segment(tag)
+                if _segments is not None:
+                    _segments[tag] = parts
+            for values, part in zip(result, parts):
+                values.extend(part)
+        return result
+
+    def normalize_many(self, column):
+        '''NormalizedTags for every tag string of an iterable, e.g. a pandas column'''
+        segments = {}
+        return [self.normalize(tags, segments) for tags in column]
+
+    def documents(self, column):
+        '''one vectorizer input document per tag string'''
+        return [' '.join(normalized.known) for normalized in self.normalize_many(column)]
+
+
+_tag_index = {}
+
+
+def tag_index():
+    '''the shared TagIndex over the tags vocabulary, rebuilt after a model reload'''
+    index = _tag_index.get(registry.generation)
+    if index is None:
+        if registry.exists('tags_compact'):
+            compact = registry.get('tags_compact')
+            vocabulary, token_pattern = compact.terms, compact.state['token_pattern']
+        else:
+            vectorizer = registry.get('tags_vectorizer')
+            vocabulary, token_pattern = vectorizer.vocabulary_, vectorizer.token_pattern
+        index = TagIndex(vocabulary, token_pattern)
+        _tag_index.clear()
+        _tag_index[registry.generation] = index
+    return index
+
+
+def normalize_tags(tags):
+    return tag_index().normalize(tags)
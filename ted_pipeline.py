@@ -0,0 +1,211 @@
+'''Text cleaning and the transcript + tags prediction pipeline.'''
+import os
+
+import numpy as np
+
+from model_registry import registry
+from prediction_cache import LRUCache, memoize, text_key
+from prediction_store import prediction_store
+from tag_index import normalize_tags, tag_index
+from ted_examples import example_keynote, example_tags
+
+CACHE_SIZE = int(os.environ.get('TED_CACHE_SIZE', 128))
+# seconds; 0 keeps entries until they are evicted
+CACHE_TTL = float(os.environ.get('TED_CACHE_TTL', 0)) or None
+# 'auto' scores through the compact artifacts when they exist, 'sklearn' never does
+MODEL_FORMAT = os.environ.get('TED_MODEL_FORMAT', 'auto')
+# 'spacy' runs the full tagging pipeline, 'fast' the lookup lemmatizer of fast_lemmatizer.py
+PREPROCESSING = os.environ.get('TED_PREPROCESSING', 'spacy')
+# when set, the app asks the HTTP prediction service (ted_service.py) instead
+SERVICE_URL = os.environ.get('TED_SERVICE_URL')
+
+POPULARITY = ('Unpopular', 'Popular')
+
+clean_text_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+prediction_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+# final trans_pred_proba of streamed transcripts (transcript_stream.py)
+stream_cache = LRUCache(CACHE_SIZE, CACHE_TTL)
+
+
+CONTENT_POS = {'NOUN', 'VERB', 'ADJ', 'ADV', 'PROPN'}
+
+
+def _lemmas(doc):
+    return ' '.join(token.lemma_ for token in doc if token.pos_ in CONTENT_POS)
+
+
+def _backend(backend):
+    backend = backend or PREPROCESSING
+    if backend not in ('spacy', 'fast'):
+        raise ValueError('unknown preprocessing backend: {}'.format(backend))
+    return backend
+
+
+def _clean_text_key(text, backend=None):
+    backend = _backend(backend)
+    if backend == 'fast':
+        # a built or reloaded lemma table changes the cleaned text
+        return backend, registry.generation, registry.exists('lemma_table'), text_key(text)
+    return backend, text_key(text)
+
+
+@memoize(clean_text_cache, key=_clean_text_key)
+def clean_text(text, backend=None):
+    '''reduce text to lower-case lexicon entry'''
+    if _backend(backend) == 'fast':
+        from fast_lemmatizer import fast_lemmatizer
+        return fast_lemmatizer().clean(text)
+    return _lemmas(registry.nlp()(text))
+
+
+def clean_texts(texts, n_process=1, batch_size=32, backend=None):
+    '''clean_text for many texts, streamed through nlp.pipe'''
+    if _backend(backend) == 'fast':
+        from fast_lemmatizer import fast_lemmatizer
+        yield from fast_lemmatizer().pipe(texts)
+        return
+    for doc in registry.nlp().pipe(texts, n_process=n_process, batch_size=batch_size):
+        yield _lemmas(doc)
+
+
+def clean_tags(tags):
+    '''tags in vocabulary form, e.g. 'medical research' -> 'medical_research' (see tag_index.py)'''
+    return normalize_tags(tags).tags
+
+
+def ensemble_prediction(trans_pred_proba, tags_pred_proba):
+    avg_pred = (trans_pred_proba[0] + tags_pred_proba[0]) / 2
+    if max(avg_pred) == avg_pred[1]:
+        return (1, avg_pred)
+    else:
+        return 0, avg_pred
+
+
+def score(prefix, docs):
+    '''predict_proba of the 'transcript' or 'tags' model for already cleaned documents'''
+    if MODEL_FORMAT != 'sklearn' and registry.exists(prefix + '_compact'):
+        return registry.get(prefix + '_compact').predict_proba(docs)
+    vectorizer, selector, model = registry.pipeline(prefix)
+    return model.predict_proba(selector.transform(vectorizer.transform(docs)))
+
+
+def _proba(p):
+    return np.array([[1 - p, p]])
+
+
+def stored_transcript_proba(transcript):
+    '''trans_pred_proba from the prediction store for an identical transcript, or None'''
+    store = prediction_store(PREPROCESSING)
+    stored = store.by_transcript(transcript) if store is not None else None
+    return None if stored is None else _proba(stored['transcript_proba'])
+
+
+def transcript_proba(transcript):
+    '''looked up in the prediction store for known transcripts, predicted otherwise'''
+    stored = stored_transcript_proba(transcript)
+    if stored is not None:
+        return stored
+    store = prediction_store(PREPROCESSING)
+    cleaned = clean_text(transcript)
+    stored = store.by_clean_text(cleaned) if store is not None else None
+    if stored is not None:
+        return _proba(stored['transcript_proba'])
+    return score('transcript', [cleaned])
+
+
+def tags_proba(tags):
+    return score('tags', tag_index().documents([tags]))
+
+
+def _prediction_key(transcript, tags):
+    # the generation changes whenever a model is hot-reloaded
+    return registry.generation, PREPROCESSING, text_key(transcript), text_key(tags)
+
+
+@memoize(prediction_cache, key=_prediction_key)
+def predict(transcript, tags):
+    '''(trans_pred_proba, tags_pred_proba, ensemble_prediction) for one talk'''
+    trans_pred_proba = transcript_proba(transcript)
+    tags_pred_proba = tags_proba(tags)
+    return trans_pred_proba, tags_pred_proba, ensemble_prediction(trans_pred_proba, tags_pred_proba)
+
+
+def summarize(trans_pred_proba, tags_pred_proba, prediction):
+    '''JSON-friendly view of one prediction'''
+    return {
+        'transcript_proba': float(trans_pred_proba[0][1]),
+        'tags_proba': float(tags_pred_proba[0][1]),
+        'popular_proba': float(prediction[1][1]),
+        'prediction': int(prediction[0]),
+        'popularity': POPULARITY[prediction[0]],
+    }
+
+
+def predict_cleaned(cleaned_transcripts, tags):
+    '''summaries for talks whose transcripts are already cleaned; each model scores all talks at once'''
+    normalized = tag_index().normalize_many(tags)
+    trans_pred_proba = score('transcript', list(cleaned_transcripts))
+    tags_pred_proba = score('tags', [' '.join(talk_tags.known) for talk_tags in normalized])
+    summaries = []
+    for i, talk_tags in enumerate(normalized):
+        trans_row, tags_row = trans_pred_proba[i:i + 1], tags_pred_proba[i:i + 1]
+        summary = summarize(trans_row, tags_row, ensemble_prediction(trans_row, tags_row))
+        summary['unknown_tags'] = talk_tags.unknown
+        summaries.append(summary)
+    return summaries
+
+
+def remote_predict(transcript, tags, url=None, timeout=60):
+    '''predict() through the HTTP prediction service'''
+    import requests
+
+    response = requests.post((url or SERVICE_URL).rstrip('/') + '/predict',
+                             json={'transcript': transcript, 'tags': tags}, timeout=timeout)
+    response.raise_for_status()
+    return from_summary(response.json())
+
+
+def from_summary(summary):
+    '''(trans_pred_proba, tags_pred_proba, ensemble_prediction) back from a summary'''
+    trans_pred_proba = _proba(summary['transcript_proba'])
+    tags_pred_proba = _proba(summary['tags_proba'])
+    return trans_pred_proba, tags_pred_proba, ensemble_prediction(trans_pred_proba, tags_pred_proba)
+
+
+def lookup_talk(url_or_title):
+    '''stored prediction for a talk of the TED dataset, or None'''
+    store = prediction_store(PREPROCESSING)
+    summary = store.by_talk(url_or_title) if store is not None else None
+    return None if summary is None else from_summary(summary)
+
+
+def predict_talk(transcript, tags):
+    '''predict() in this process, or through the service when TED_SERVICE_URL is set'''
+    if SERVICE_URL:
+        return remote_predict(transcript, tags)
+    return predict(transcript, tags)
+
+
+_example = {}
+
+
+def example_prediction():
+    '''prediction for the static example talk, computed once per process (and model generation)'''
+    key = 'remote' if SERVICE_URL else registry.generation
+    result = _example.get(key)
+    if result is None:
+        if SERVICE_URL:
+            result = remote_predict(example_keynote, example_tags)
+        else:
+            result = predict.uncached(example_keynote, example_tags)
+        _example.clear()
+        _example[key] = result
+    return result
+
+
+def cache_stats():
+    return {
+        'clean_text': clean_text_cache.stats(),
+        'prediction': prediction_cache.stats(),
+        'stream': stream_cache.stats(),
+    }
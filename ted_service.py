@@ -0,0 +1,240 @@
+'''HTTP prediction service for the transcript + tags ensemble.
+
+    python ted_service.py --port 8000 --workers 2
+
+POST /predict         {"transcript": "...", "tags": "..."}
+POST /predict/batch   {"talks": [{"transcript": "...", "tags": "..."}, ...]}
+GET  /healthz         the process is up
+GET  /readyz          the models are loaded (?timeout=seconds waits for it)
+
+Lemmatization runs in a pool of worker processes, each with its own spaCy
+pipeline, so the event loop never blocks on it. Requests arriving within
+--max-wait-ms of each other are collected into one nlp.pipe call and one
+predict_proba call per model.
+'''
+import argparse
+import asyncio
+import json
+import multiprocessing
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import tornado.ioloop
+import tornado.web
+
+from model_registry import registry
+from ted_pipeline import clean_texts, predict_cleaned
+
+
+def _init_worker():
+    registry.nlp()
+
+
+def _clean_batch(texts):
+    return list(clean_texts(texts))
+
+
+class MicroBatcher:
+    '''collects concurrent predictions into batches of up to max_batch talks'''
+
+    def __init__(self, clean_executor, score_executor, max_batch=32, max_wait=0.01, concurrency=1):
+        self.clean_executor = clean_executor
+        self.score_executor = score_executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(concurrency)
+        self.batches = 0
+        self.talks = 0
+
+    async def predict(self, transcript, tags):
+        future = asyncio.get_event_loop().create_future()
+        await self.queue.put((transcript, tags, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            asyncio.ensure_future(self._process(batch))
+
+    async def _process(self, batch):
+        loop = asyncio.get_event_loop()
+        try:
+            transcripts = [transcript for transcript, _, _ in batch]
+            tags = [talk_tags for _, talk_tags, _ in batch]
+            cleaned = await loop.run_in_executor(self.clean_executor, _clean_batch, transcripts)
+            summaries = await loop.run_in_executor(self.score_executor, predict_cleaned, cleaned, tags)
+            for (_, _, future), summary in zip(batch, summaries):
+                if not future.done():
+                    future.set_result(summary)
+            self.batches += 1
+            self.talks += len(batch)
+        except Exception as error:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(error)
+        finally:
+            self.slots.release()
+
+
+class Service:
+    '''executors, readiness and the micro-batcher shared by all handlers'''
+
+    def __init__(self, workers=1, max_batch=32, max_wait=0.01):
+        if workers > 0:
+            self.clean_executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker)
+        else:
+            # lemmatize in a thread of this process, with the shared spaCy pipeline
+            self.clean_executor = ThreadPoolExecutor(max_workers=1)
+        self.score_executor = ThreadPoolExecutor(max_workers=1)
+        self.batcher = MicroBatcher(self.clean_executor, self.score_executor,
+                                    max_batch, max_wait, concurrency=max(workers, 1))
+        self.ready = asyncio.Event()
+        self.error = None
+
+    async def start(self):
+        asyncio.ensure_future(self.batcher.run())
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(self.score_executor, registry.pipeline, 'transcript')
+            await loop.run_in_executor(self.score_executor, registry.pipeline, 'tags')
+            # starts the workers and loads spaCy in them
+            await loop.run_in_executor(self.clean_executor, _clean_batch, ['warm up'])
+        except Exception as error:
+            self.error = repr(error)
+            raise
+        self.ready.set()
+
+    async def wait_ready(self, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(self.ready.wait()), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.ready.is_set()
+
+    def shutdown(self):
+        self.clean_executor.shutdown(wait=False)
+        self.score_executor.shutdown(wait=False)
+
+
+class JSONHandler(tornado.web.RequestHandler):
+
+    def initialize(self, service):
+        self.service = service
+
+    def json_body(self):
+        try:
+            return json.loads(self.request.body or b'{}')
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='request body is not valid JSON')
+
+    def write_error(self, status_code, **kwargs):
+        self.finish({'error': self._reason})
+
+    def timeout_argument(self, default):
+        try:
+            return float(self.get_argument('timeout', default))
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason='timeout has to be a number of seconds')
+
+    async def require_ready(self):
+        timeout = self.timeout_argument(30)
+        if not await self.service.wait_ready(timeout):
+            raise tornado.web.HTTPError(503, reason=self.service.error or 'models are still loading')
+
+
+def _talk(body):
+    if not isinstance(body, dict):
+        raise tornado.web.HTTPError(400, reason='a talk is an object with transcript and tags')
+    transcript, tags = body.get('transcript') or '', body.get('tags') or ''
+    if not isinstance(transcript, str) or not isinstance(tags, str):
+        raise tornado.web.HTTPError(400, reason='transcript and tags have to be strings')
+    return transcript, tags
+
+
+class PredictHandler(JSONHandler):
+
+    async def post(self):
+        transcript, tags = _talk(self.json_body())
+        await self.require_ready()
+        self.write(await self.service.batcher.predict(transcript, tags))
+
+
+class BatchPredictHandler(JSONHandler):
+
+    async def post(self):
+        body = self.json_body()
+        talks = body.get('talks') if isinstance(body, dict) else None
+        if not isinstance(talks, list):
+            raise tornado.web.HTTPError(400, reason='talks has to be a list')
+        talks = [_talk(talk) for talk in talks]
+        await self.require_ready()
+        summaries = await asyncio.gather(*(self.service.batcher.predict(transcript, tags)
+                                           for transcript, tags in talks))
+        self.write({'predictions': list(summaries)})
+
+
+class HealthHandler(JSONHandler):
+
+    def get(self):
+        self.write({'status': 'ok'})
+
+
+class ReadyHandler(JSONHandler):
+
+    async def get(self):
+        timeout = self.timeout_argument(0)
+        if not await self.service.wait_ready(timeout):
+            self.set_status(503)
+            self.write({'ready': False, 'error': self.service.error})
+            return
+        self.write({'ready': True, 'batches': self.service.batcher.batches,
+                    'talks': self.service.batcher.talks, 'models': registry.metrics()})
+
+
+def make_app(service):
+    return tornado.web.Application([
+        (r'/predict', PredictHandler, {'service': service}),
+        (r'/predict/batch', BatchPredictHandler, {'service': service}),
+        (r'/healthz', HealthHandler, {'service': service}),
+        (r'/readyz', ReadyHandler, {'service': service}),
+    ])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='spaCy worker processes, 0 lemmatizes in this process')
+    parser.add_argument('--max-batch', type=int, default=32, help='talks per micro-batch')
+    parser.add_argument('--max-wait-ms', type=float, default=10,
+                        help='how long a micro-batch waits for more talks')
+    args = parser.parse_args(argv)
+
+    service = Service(args.workers, args.max_batch, args.max_wait_ms / 1000)
+    make_app(service).listen(args.port, address=args.host)
+    io_loop = tornado.ioloop.IOLoop.current()
+    io_loop.spawn_callback(service.start)
+    try:
+        io_loop.start()
+    finally:
+        service.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+'''The compact scorers reproduce predict_proba of the shipped pickles and of n-gram pipelines.'''
+import pytest
+
+pytest.importorskip('sklearn')
+
+import numpy as np  # noqa: E402
+from compact_model import check_parity, export_compact, parity_documents  # noqa: E402
+from model_registry import registry  # noqa: E402
+
+
+def _pipeline(prefix):
+    if not registry.exists(prefix + '_vectorizer'):
+        pytest.skip('{} pickles are not shipped'.format(prefix))
+    return registry.pipeline(prefix)
+
+
+@pytest.mark.parametrize('prefix', ['tags', 'transcript'])
+def test_parity(prefix):
+    vectorizer, selector, model = _pipeline(prefix)
+    scorer = export_compact(vectorizer, selector, model)
+    check_parity(scorer, vectorizer, selector, model, parity_documents(vectorizer))
+
+
+@pytest.mark.parametrize('prefix', ['tags', 'transcript'])
+def test_counts_add_up(prefix):
+    vectorizer, selector, model = _pipeline(prefix)
+    scorer = export_compact(vectorizer, selector, model)
+    docs = parity_documents(vectorizer, n_docs=20)
+    counts = scorer.count(docs[:1])
+    for doc in docs[1:]:
+        counts = counts + scorer.count([doc])
+    expected = selector.transform(vectorizer.transform([' '.join(docs)]))
+    np.testing.assert_allclose(scorer.weight(counts).toarray(), expected.toarray(), atol=1e-9)
+
+
+@pytest.mark.parametrize('ngram_range', [(1, 3), (1, 4), (2, 3)])
+def test_parity_ngrams(ngram_range):
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.feature_selection import SelectKBest, chi2
+    from sklearn.linear_model import LogisticRegression
+
+    rng = np.random.RandomState(0)
+    words = ['sleep', 'memory', 'brain', 'dream', 'night', 'learn']
+    docs = [' '.join(rng.choice(words, size=rng.randint(1, 30))) for _ in range(200)]
+    labels = np.array([int('sleep memory' in doc) for doc in docs])
+    vectorizer = TfidfVectorizer(ngram_range=ngram_range)
+    X = vectorizer.fit_transform(docs)
+    selector = SelectKBest(chi2, k=min(50, X.shape[1])).fit(X, labels)
+    model = LogisticRegression().fit(selector.transform(X), labels)
+    scorer = export_compact(vectorizer, selector, model)
+    check_parity(scorer, vectorizer, selector, model, docs + parity_documents(vectorizer, n_docs=20))
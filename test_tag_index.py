@@ -0,0 +1,40 @@
+'''TagIndex matches whole tag segments and reports what the model does not know.'''
+from tag_index import TagIndex
+
+VOCABULARY = ['medical_research', 'human_body', 'sleep', 'medicine', 'self', 'ai']
+
+
+def test_trailing_space():
+    assert TagIndex(VOCABULARY).normalize('sleep ').known == ['sleep']
+
+
+def test_multi_word_tags():
+    normalized = TagIndex(VOCABULARY).normalize('Medical Research\nhuman body, sleep')
+    assert normalized.known == ['medical_research', 'human_body', 'sleep']
+    assert normalized.unknown == []
+
+
+def test_unknown_multi_word_tag_is_not_split():
+    normalized = TagIndex(VOCABULARY).normalize('sleep medicine\nsleep')
+    assert normalized.known == ['sleep']
+    assert normalized.unknown == ['sleep_medicine']
+
+
+def test_tokens_follow_the_token_pattern():
+    normalized = TagIndex(VOCABULARY).normalize('Self-help, AI')
+    assert normalized.known == ['self', 'ai']
+    assert normalized.unknown == ['help']
+
+
+def test_dropped_segments_are_reported():
+    normalized = TagIndex(VOCABULARY).normalize('a b\n3\nsleep')
+    assert normalized.known == ['sleep']
+    assert normalized.unknown == ['a_b', '3']
+
+
+def test_normalize_many():
+    index = TagIndex(VOCABULARY)
+    column = ['sleep\nmedicine', '', None, 'sleep medicine']
+    assert [normalized.known for normalized in index.normalize_many(column)] == \
+        [['sleep', 'medicine'], [], [], []]
+    assert index.documents(column) == ['sleep medicine', '', '', '']
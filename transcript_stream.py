@@ -0,0 +1,118 @@
+'''Streaming prediction for very long transcripts.
+
+Instead of handing the whole transcript to nlp() as one Doc, it is split on
+paragraph and speaker boundaries (blank lines, "(Laughter)"/"(Applause)"
+markers) into chunks of at most max_chars characters. The chunks go through
+nlp.pipe, the raw term counts of every cleaned chunk are added to a running
+sparse vector, and a partial probability is reported after each chunk. With
+the default batch_size of 1 only one chunk's Doc is alive at a time, and
+spaCy's max_length never applies to the whole transcript.
+
+Lemmas are tagged within their chunk, so the final probability can differ
+marginally from the single-pass clean_text where a sentence spans a chunk
+boundary; chunks only break inside a paragraph when it is longer than
+max_chars.
+'''
+import os
+import re
+
+from model_registry import registry
+from prediction_cache import text_key
+import ted_pipeline
+
+# blank lines, and stage directions such as (Laughter) or (Applause), which are kept
+# as paragraphs of their own because clean_text counts them too
+BOUNDARY = re.compile(r'\n\s*\n|(\(\s*(?:Laughter|Applause|Music|Cheers|Video)[^)]*\))',
+                      re.IGNORECASE)
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+MAX_CHARS = 10000
+# transcripts longer than this are streamed by the app
+STREAM_THRESHOLD = int(os.environ.get('TED_STREAM_CHARS', 20000))
+
+
+def _split_long(paragraph, max_chars):
+    '''break an oversized paragraph at sentence ends, or at whitespace as a last resort'''
+    piece = ''
+    for sentence in SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            cut = sentence.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            if piece:
+                yield piece
+                piece = ''
+            yield sentence[:cut]
+            sentence = sentence[cut:].lstrip()
+        if piece and len(piece) + len(sentence) + 1 > max_chars:
+            yield piece
+            piece = ''
+        piece = piece + ' ' + sentence if piece else sentence
+    if piece:
+        yield piece
+
+
+def split_transcript(text, max_chars=MAX_CHARS):
+    '''paragraph-aligned chunks of at most max_chars characters'''
+    chunk = ''
+    for paragraph in BOUNDARY.split(text):
+        paragraph = (paragraph or '').strip()
+        if not paragraph:
+            continue
+        pieces = [paragraph] if len(paragraph) <= max_chars else _split_long(paragraph, max_chars)
+        for piece in pieces:
+            if chunk and len(chunk) + len(piece) + 2 > max_chars:
+                yield chunk
+                chunk = ''
+            chunk = chunk + '\n\n' + piece if chunk else piece
+    if chunk:
+        yield chunk
+
+
+def count_scorer(prefix='transcript'):
+    '''(count, proba): count(docs) gives additive raw term counts, proba(counts) finishes the model'''
+    if ted_pipeline.MODEL_FORMAT != 'sklearn' and registry.exists(prefix + '_compact'):
+        scorer = registry.get(prefix + '_compact')
+        return scorer.count, scorer.predict_proba_counts
+
+    from sklearn.feature_extraction.text import CountVectorizer
+
+    vectorizer, selector, model = registry.pipeline(prefix)
+
+    def count(docs):
+        # the raw counts, before TfidfVectorizer weights and normalizes them
+        return CountVectorizer.transform(vectorizer, docs)
+
+    def proba(counts):
+        X = vectorizer._tfidf.transform(counts) if hasattr(vectorizer, '_tfidf') else counts
+        return model.predict_proba(selector.transform(X))
+
+    return count, proba
+
+
+def _stream_key(transcript, backend=None):
+    return registry.generation, ted_pipeline._backend(backend), text_key(transcript)
+
+
+def stream_transcript_proba(transcript, max_chars=MAX_CHARS, batch_size=1, backend=None):
+    '''yield (chunks done, total chunks, trans_pred_proba so far) after every chunk
+
+    A transcript streamed before (with the same models and backend) yields its
+    final probability at once.
+    '''
+    key = _stream_key(transcript, backend)
+    cached = ted_pipeline.stream_cache.get(key)
+    if cached is not None:
+        yield 1, 1, cached
+        return
+    chunks = list(split_transcript(transcript, max_chars))
+    count, proba = count_scorer('transcript')
+    counts = count([''])
+    trans_pred_proba = proba(counts)
+    if not chunks:
+        yield 0, 0, trans_pred_proba
+    cleaned_chunks = ted_pipeline.clean_texts(chunks, batch_size=batch_size, backend=backend)
+    for done, cleaned in enumerate(cleaned_chunks, 1):
+        counts = counts + count([cleaned])
+        trans_pred_proba = proba(counts)
+        yield done, len(chunks), trans_pred_proba
+    ted_pipeline.stream_cache.set(key, trans_pred_proba)